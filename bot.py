@@ -1,7 +1,9 @@
+import asyncio
 import logging
-import sqlite3
+import aiosqlite
 from telegram import Update, MessageOriginType
 from telegram.ext import (
+    AIORateLimiter,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
@@ -17,103 +19,281 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize SQLite database
-conn = sqlite3.connect('bot.db')
-cursor = conn.cursor()
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS broadcasts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        original_message_id INTEGER,
-        broadcast_message_ids TEXT
+DB_PATH = 'bot.db'
+
+# Statements issued by the handlers; identical text hits the statement cache
+SQL_INSERT_BROADCAST = 'INSERT INTO broadcasts (original_message_id) VALUES (?)'
+SQL_INSERT_TARGET = 'INSERT INTO broadcast_targets (broadcast_id, channel_id, message_id) VALUES (?, ?, ?)'
+SQL_SELECT_TARGETS = (
+    'SELECT b.id, t.channel_id, t.message_id FROM broadcasts b '
+    'LEFT JOIN broadcast_targets t ON t.broadcast_id = b.id WHERE b.id = '
+    '(SELECT id FROM broadcasts WHERE original_message_id = ? ORDER BY id DESC LIMIT 1)'
+)
+SQL_DELETE_BROADCAST = 'DELETE FROM broadcasts WHERE id = ?'
+
+# Replies sent back to the admin
+REPLY_REGISTERED = "Channel ID {channel_id} registered."
+REPLY_BROADCAST_USAGE = "Please reply to the message you want to broadcast."
+REPLY_BROADCAST_DONE = "Broadcast completed."
+REPLY_DELETE_USAGE = "Please reply to the broadcasted message you want to delete."
+REPLY_DELETE_NOT_FOUND = "No broadcast record found for this message."
+REPLY_DELETE_DONE = "Broadcast messages deleted."
+
+# Upper bound on Telegram API calls in flight during a fan-out
+MAX_CONCURRENT_SENDS = 25
+
+# RetryAfter retries per API call; AIORateLimiter pauses every request meanwhile
+MAX_FLOOD_RETRIES = 3
+
+# Seconds post_shutdown waits for queued broadcast records to be written
+WRITE_FLUSH_TIMEOUT = 10
+
+async def init_db():
+    """Open the long-lived SQLite connection shared by all handlers."""
+    db = await aiosqlite.connect(DB_PATH)
+
+    try:
+        # WAL keeps commits cheap and lets readers run alongside writers
+        await db.execute('PRAGMA journal_mode=WAL')
+        await db.execute('PRAGMA synchronous=NORMAL')
+        await db.execute('PRAGMA temp_store=MEMORY')
+        await db.execute('PRAGMA cache_size=-64000')
+        await db.execute('PRAGMA mmap_size=268435456')
+        await db.execute('PRAGMA busy_timeout=5000')
+        await db.execute('PRAGMA foreign_keys=ON')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                original_message_id INTEGER
+            )
+        ''')
+        await db.execute(
+            'CREATE INDEX IF NOT EXISTS idx_broadcasts_original ON broadcasts(original_message_id)'
+        )
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_targets (
+                broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL
+            )
+        ''')
+        await db.execute(
+            'CREATE INDEX IF NOT EXISTS idx_broadcast_targets_broadcast ON broadcast_targets(broadcast_id)'
+        )
+        await migrate_legacy_broadcasts(db)
+        await db.commit()
+    except Exception:
+        # Not handed to post_init yet, so nothing else would close it
+        await db.close()
+        raise
+    return db
+
+async def migrate_legacy_broadcasts(db):
+    """Move message IDs from the old CSV column into broadcast_targets."""
+    columns = [row[1] for row in await db.execute_fetchall('PRAGMA table_info(broadcasts)')]
+    if 'broadcast_message_ids' not in columns:
+        return
+
+    legacy = await db.execute_fetchall(
+        'SELECT id, broadcast_message_ids FROM broadcasts WHERE broadcast_message_ids IS NOT NULL'
+    )
+
+    # Pair IDs with the configured channels the same way the old /delete did
+    targets = [
+        (broadcast_id, channel_id, int(msg_id))
+        for broadcast_id, csv in legacy
+        for channel_id, msg_id in zip(config.BROADCAST_CHANNEL_IDS, csv.split(','))
+        if msg_id
+    ]
+    await db.executemany(SQL_INSERT_TARGET, targets)
+    await db.execute(
+        'UPDATE broadcasts SET broadcast_message_ids = NULL WHERE broadcast_message_ids IS NOT NULL'
     )
-''')
-conn.commit()
+
+    if legacy:
+        logger.info("Migrated %s legacy broadcast records", len(legacy))
+
+async def post_init(application):
+    application.bot_data["db"] = await init_db()
+    application.bot_data["send_semaphore"] = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+    application.bot_data["write_queue"] = asyncio.Queue()
+    application.bot_data["writer_task"] = asyncio.create_task(write_broadcasts(application))
+
+async def post_shutdown(application):
+    # post_shutdown also runs when post_init failed, so skip what was never set up
+    queue = application.bot_data.get("write_queue")
+    writer_task = application.bot_data.get("writer_task")
+    db = application.bot_data.get("db")
+
+    if writer_task is not None:
+        # Flush broadcast records still waiting to be written
+        if not writer_task.done():
+            try:
+                await asyncio.wait_for(queue.join(), WRITE_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error("Gave up writing %s queued broadcast records", queue.qsize())
+
+        writer_task.cancel()
+        try:
+            await writer_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error("Broadcast writer stopped unexpectedly: %s", e)
+
+    if db is not None:
+        await db.close()
+
+async def write_broadcasts(application):
+    """Persist broadcast records queued by /broadcast, off the reply path."""
+    db = application.bot_data["db"]
+    queue = application.bot_data["write_queue"]
+
+    while True:
+        original_message_id, targets = await queue.get()
+        try:
+            # Store the broadcast and one row per delivered copy in one transaction
+            cursor = await db.execute(
+                SQL_INSERT_BROADCAST,
+                (original_message_id,)
+            )
+            broadcast_id = cursor.lastrowid
+            await db.executemany(
+                SQL_INSERT_TARGET,
+                [(broadcast_id, channel_id, msg_id) for channel_id, msg_id in targets]
+            )
+            await db.commit()
+        except Exception as e:
+            logger.error("Failed to store broadcast of message %s: %s", original_message_id, e)
+            try:
+                await db.rollback()
+            except Exception as rollback_error:
+                logger.error(
+                    "Failed to roll back broadcast of message %s: %s", original_message_id, rollback_error
+                )
+        finally:
+            queue.task_done()
+
+class ChannelForwardFilter(filters.MessageFilter):
+    """Matches messages forwarded from a channel."""
+
+    def filter(self, message):
+        return (
+            message.forward_origin is not None
+            and message.forward_origin.type == MessageOriginType.CHANNEL
+        )
 
 async def register_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.effective_message
 
-    # Check if the message is forwarded
-    if message.forward_origin and message.forward_origin.type == MessageOriginType.CHANNEL:
-        original_channel_id = message.forward_origin.chat.id
-        logger.info(f"Registered channel ID: {original_channel_id}")
-        await message.reply_text(f"Channel ID {original_channel_id} registered.")
-    else:
-        logger.warning("Forwarded message lacks origin information.")
-        await message.reply_text("Unable to register channel: no origin information found.")
+    # Only channel forwards get past ChannelForwardFilter
+    original_channel_id = message.forward_origin.chat.id
+    logger.info("Registered channel ID: %s", original_channel_id)
+    await message.reply_text(REPLY_REGISTERED.format(channel_id=original_channel_id))
 
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.effective_message
 
     if not message.reply_to_message:
-        await message.reply_text("Please reply to the message you want to broadcast.")
+        await message.reply_text(REPLY_BROADCAST_USAGE)
         return
 
     original_message = message.reply_to_message
-    broadcast_message_ids = []
+    targets = []
 
-    for channel_id in config.BROADCAST_CHANNEL_IDS:
-        try:
-            sent_message = await context.bot.copy_message(
+    semaphore = context.application.bot_data["send_semaphore"]
+
+    async def send_one(channel_id):
+        async with semaphore:
+            return await context.bot.copy_message(
                 chat_id=channel_id,
                 from_chat_id=original_message.chat.id,
                 message_id=original_message.message_id
             )
-            broadcast_message_ids.append(str(sent_message.message_id))
-        except Exception as e:
-            logger.error(f"Failed to broadcast to {channel_id}: {e}")
 
-    # Store the broadcast information in the database
-    cursor.execute(
-        'INSERT INTO broadcasts (original_message_id, broadcast_message_ids) VALUES (?, ?)',
-        (original_message.message_id, ','.join(broadcast_message_ids))
+    results = await asyncio.gather(
+        *(send_one(channel_id) for channel_id in config.BROADCAST_CHANNEL_IDS),
+        return_exceptions=True
     )
-    conn.commit()
 
-    await message.reply_text("Broadcast completed.")
+    for channel_id, result in zip(config.BROADCAST_CHANNEL_IDS, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to broadcast to %s: %s", channel_id, result)
+        else:
+            targets.append((channel_id, result.message_id))
+
+    # Reply right away; the record is written in the background
+    await context.application.bot_data["write_queue"].put((original_message.message_id, targets))
+
+    await message.reply_text(REPLY_BROADCAST_DONE)
 
 async def delete_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.effective_message
 
     if not message.reply_to_message:
-        await message.reply_text("Please reply to the broadcasted message you want to delete.")
+        await message.reply_text(REPLY_DELETE_USAGE)
         return
 
+    db = context.application.bot_data["db"]
     original_message_id = message.reply_to_message.message_id
 
-    # Retrieve the broadcast message IDs from the database
-    cursor.execute(
-        'SELECT broadcast_message_ids FROM broadcasts WHERE original_message_id = ?',
-        (original_message_id,)
-    )
-    result = cursor.fetchone()
+    # Make sure broadcasts queued for writing are visible to the lookup below
+    if not context.application.bot_data["writer_task"].done():
+        await context.application.bot_data["write_queue"].join()
 
-    if not result:
-        await message.reply_text("No broadcast record found for this message.")
-        return
+    semaphore = context.application.bot_data["send_semaphore"]
 
-    broadcast_message_ids = result[0].split(',')
+    async def delete_one(channel_id, msg_id):
+        async with semaphore:
+            try:
+                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
+            except Exception as e:
+                logger.error("Failed to delete message %s in channel %s: %s", msg_id, channel_id, e)
 
-    for channel_id, msg_id in zip(config.BROADCAST_CHANNEL_IDS, broadcast_message_ids):
-        try:
-            await context.bot.delete_message(chat_id=channel_id, message_id=int(msg_id))
-        except Exception as e:
-            logger.error(f"Failed to delete message {msg_id} in channel {channel_id}: {e}")
+    # Look up the copies of the most recent broadcast of this message and
+    # start deleting as rows arrive instead of materializing every target first.
+    # A broadcast whose sends all failed comes back as one row without a target.
+    broadcast_id = None
+    tasks = []
+    async with db.execute(SQL_SELECT_TARGETS, (original_message_id,)) as cursor:
+        async for row_broadcast_id, channel_id, msg_id in cursor:
+            broadcast_id = row_broadcast_id
+            if channel_id is not None:
+                tasks.append(asyncio.create_task(delete_one(channel_id, msg_id)))
+
+    if broadcast_id is None:
+        await message.reply_text(REPLY_DELETE_NOT_FOUND)
+        return
+
+    await asyncio.gather(*tasks)
 
     # Optionally, remove the record from the database
-    cursor.execute(
-        'DELETE FROM broadcasts WHERE original_message_id = ?',
-        (original_message_id,)
+    await db.execute(
+        SQL_DELETE_BROADCAST,
+        (broadcast_id,)
     )
-    conn.commit()
+    await db.commit()
 
-    await message.reply_text("Broadcast messages deleted.")
+    await message.reply_text(REPLY_DELETE_DONE)
 
 def main():
-    application = ApplicationBuilder().token(config.BOT_TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=30,
+            overall_time_period=1,
+            max_retries=MAX_FLOOD_RETRIES
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Handler to register channels via forwarded messages
     application.add_handler(MessageHandler(
-        filters.Chat(config.REGISTRATION_CHANNEL_ID) & filters.FORWARDED,
+        filters.Chat(config.REGISTRATION_CHANNEL_ID) & ChannelForwardFilter(),
         register_channel
     ))
 